@@ -1,7 +1,15 @@
+import hashlib
 import io
+import json
 import os
 import re
+import sqlite3
+import threading
 import uuid
+import zipfile
+import zlib
+from contextlib import closing
+from concurrent.futures import ThreadPoolExecutor
 from datetime import date, datetime
 
 import pandas as pd
@@ -81,6 +89,18 @@ BANKS = [
 
 CC_ADVANCE_TEMPLATE = "CCTemplate.docx"
 SD_TEMPLATE = "SDTemplate.docx"
+ARCHIVE_DB = "challan_archive.db"
+ARCHIVE_TIMEOUT = 10
+FINALIZE_PROGRESS_STEP = 10
+FINALIZE_JOB_LIMIT = 20
+
+ARCHIVE_SEARCH_FIELDS = {
+    "Consumer Number": "consumer",
+    "Challan Number": "challan",
+    "Month / Period": "month",
+    "Instrument No.": "pay_no",
+    "Amount": "amount",
+}
 
 OTHER_PURPOSES = [
     "Advance Payment",
@@ -105,6 +125,8 @@ MONTH_LIST = [
 ]
 MONTH_ABBR = ["Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec"]
 YEAR_OPTIONS = [2026, 2025]
+MONTH_NUMBER = {m: i for i, m in enumerate(MONTH_LIST, start=1)}
+ABBR_NUMBER = {a: i for i, a in enumerate(MONTH_ABBR, start=1)}
 
 
 def format_indian_currency(number):
@@ -147,11 +169,396 @@ def format_period_month_text(target_months):
     return " and ".join(parts)
 
 
+def parse_consumer_numbers(text):
+    numbers = []
+    for part in text.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        range_match = re.match(r"^(\d{1,3})\s*-\s*(\d{1,3})$", part)
+        if range_match:
+            low, high = int(range_match.group(1)), int(range_match.group(2))
+            if low > high:
+                return None
+            numbers.extend(str(n).zfill(3) for n in range(low, high + 1))
+        elif re.match(r"^\d{1,3}$", part):
+            numbers.append(part.zfill(3))
+        else:
+            return None
+    return list(dict.fromkeys(numbers))
+
+
+@st.cache_data(max_entries=256, show_spinner=False)
+def calendar_period(f_month, f_year, t_month, t_year):
+    start = f_year * 12 + MONTH_NUMBER[f_month] - 1
+    end = t_year * 12 + MONTH_NUMBER[t_month] - 1
+    target_months = [(MONTH_LIST[i % 12], i // 12) for i in range(start, end + 1)]
+    return target_months, format_period_month_text(target_months)
+
+
+@st.cache_data(max_entries=16, show_spinner=False)
+def master_month_columns(columns):
+    col_map = {}
+    for col in columns:
+        if isinstance(col, (datetime, pd.Timestamp)):
+            col_map.setdefault((col.year, col.month), col)
+            continue
+        abbr_match = re.match(r"^([A-Za-z]{3})-(\d{2})$", str(col).strip())
+        if abbr_match and abbr_match.group(1) in ABBR_NUMBER:
+            key = (2000 + int(abbr_match.group(2)), ABBR_NUMBER[abbr_match.group(1)])
+            col_map.setdefault(key, col)
+    return col_map
+
+
+@st.cache_data(max_entries=256, show_spinner=False)
+def resolve_month_columns(columns, target_months):
+    col_map = master_month_columns(columns)
+    return [
+        col_map[(y, MONTH_NUMBER[m])]
+        for m, y in target_months
+        if (y, MONTH_NUMBER[m]) in col_map
+    ]
+
+
+def master_year_options(columns):
+    years = set(YEAR_OPTIONS) | {y for y, _ in master_month_columns(columns)}
+    return sorted(years, reverse=True)
+
+
+def lookup_consumer_totals(df, numbers, month_cols):
+    keys = df["Consumer Number"].astype(str).str.zfill(3)
+    matched = df[keys.isin(numbers)].assign(_key=keys).drop_duplicates("_key")
+    totals = matched[month_cols].apply(pd.to_numeric, errors="coerce").fillna(0).sum(axis=1)
+    matched = matched.assign(_total=totals).set_index("_key")
+    found = [n for n in numbers if n in matched.index]
+    missing = [n for n in numbers if n not in matched.index]
+    return matched.loc[found], missing
+
+
 class SafeReceipt(dict):
     def __getattr__(self, key):
         return self.get(key, "")
 
 
+@st.cache_data(max_entries=4, show_spinner=False)
+def load_master_data(data_bytes):
+    return pd.read_excel(io.BytesIO(data_bytes), sheet_name="BILL")
+
+
+def template_for_purpose(selected_purpose):
+    if selected_purpose in ("C. C", "Advance Payment"):
+        return CC_ADVANCE_TEMPLATE
+    return SD_TEMPLATE
+
+
+def group_receipts_by_template(receipts):
+    groups = {}
+    for rec in receipts:
+        tpl = template_for_purpose(rec.get("selected_purpose", "C. C"))
+        groups.setdefault(tpl, []).append(rec)
+    return groups
+
+
+class ProgressReceipts(list):
+    def __init__(self, receipts, on_progress):
+        super().__init__(receipts)
+        self.on_progress = on_progress
+
+    def __iter__(self):
+        for count, rec in enumerate(super().__iter__(), start=1):
+            yield rec
+            if count % FINALIZE_PROGRESS_STEP == 0:
+                self.on_progress(count)
+
+
+def render_receipts(receipts, on_progress=None):
+    rendered = {}
+    rendered_count = 0
+    for tpl, group in group_receipts_by_template(receipts).items():
+        with open(tpl, "rb") as f:
+            doc = DocxTemplate(io.BytesIO(f.read()))
+        context = [SafeReceipt(r) for r in group]
+        if on_progress is not None:
+            offset = rendered_count
+            context = ProgressReceipts(context, lambda n, offset=offset: on_progress(offset + n))
+        doc.render({"receipts": context})
+        output = io.BytesIO()
+        doc.save(output)
+        rendered[tpl] = output.getvalue()
+        rendered_count += len(group)
+        if on_progress is not None:
+            on_progress(rendered_count)
+    return rendered
+
+
+def bundle_rendered(rendered, stamp):
+    if len(rendered) == 1:
+        (data,) = rendered.values()
+        return (
+            data,
+            f"Challans_{stamp}.docx",
+            "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+        )
+
+    output = io.BytesIO()
+    with zipfile.ZipFile(output, "w", zipfile.ZIP_DEFLATED) as zf:
+        for tpl, data in rendered.items():
+            zf.writestr(f"Challans_{stamp}_{os.path.splitext(tpl)[0]}.docx", data)
+    return output.getvalue(), f"Challans_{stamp}.zip", "application/zip"
+
+
+def archive_connection():
+    return closing(sqlite3.connect(ARCHIVE_DB, timeout=ARCHIVE_TIMEOUT))
+
+
+@st.cache_resource
+def init_archive():
+    with archive_connection() as conn:
+        conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS batches (
+                batch_id TEXT PRIMARY KEY,
+                created TEXT,
+                challan_type TEXT,
+                receipt_count INTEGER,
+                payload BLOB
+            );
+            CREATE TABLE IF NOT EXISTS receipt_index (
+                batch_id TEXT,
+                challan INTEGER,
+                consumer TEXT,
+                name TEXT,
+                month TEXT,
+                pay_no TEXT,
+                pay_nos TEXT,
+                amount INTEGER
+            );
+            CREATE INDEX IF NOT EXISTS idx_receipt_consumer ON receipt_index (consumer);
+            CREATE INDEX IF NOT EXISTS idx_receipt_challan ON receipt_index (challan);
+            CREATE INDEX IF NOT EXISTS idx_receipt_pay_no ON receipt_index (pay_no);
+            CREATE INDEX IF NOT EXISTS idx_receipt_amount ON receipt_index (amount);
+            CREATE INDEX IF NOT EXISTS idx_receipt_batch ON receipt_index (batch_id, challan);
+            CREATE TABLE IF NOT EXISTS receipt_months (
+                batch_id TEXT,
+                challan INTEGER,
+                month_key TEXT
+            );
+            CREATE INDEX IF NOT EXISTS idx_receipt_month_key ON receipt_months (month_key, batch_id, challan);
+            """
+        )
+
+
+def period_month_keys(text):
+    keys = []
+    for part in str(text).split(" and "):
+        period_match = re.match(r"^(.*) - (\d{4})$", part.strip())
+        if not period_match:
+            continue
+        year = int(period_match.group(2))
+        for month_name in period_match.group(1).split(","):
+            month_name = month_name.strip()
+            if month_name in MONTH_NUMBER:
+                keys.append(f"{year}-{MONTH_NUMBER[month_name]:02d}")
+    return list(dict.fromkeys(keys))
+
+
+def parse_month_query(value):
+    month_match = re.match(r"^([A-Za-z]+)\s*[-\s]\s*(\d{2}|\d{4})$", value.strip())
+    if not month_match:
+        return None
+    name = month_match.group(1).title()
+    month_no = MONTH_NUMBER.get(name) or ABBR_NUMBER.get(name)
+    if month_no is None:
+        return None
+    year = int(month_match.group(2))
+    if year < 100:
+        year += 2000
+    return f"{year}-{month_no:02d}"
+
+
+def parse_archive_filters(raw_filters):
+    filters = {}
+    errors = []
+    for label, value in raw_filters.items():
+        value = value.strip()
+        if not value:
+            continue
+        field = ARCHIVE_SEARCH_FIELDS[label]
+        if field == "consumer":
+            if value.upper() == "NEW":
+                filters[field] = "NEW"
+            elif re.match(r"^\d{1,3}$", value):
+                filters[field] = value.zfill(3)
+            else:
+                errors.append("Consumer Number must be 1 to 3 digits.")
+        elif field == "month":
+            month_key = parse_month_query(value)
+            if month_key:
+                filters[field] = month_key
+            else:
+                errors.append("Month must look like Aug-25, August 2025 or August - 2025.")
+        elif field == "amount":
+            if re.match(r"^\d+$", value) or re.match(r"^\d{1,3}(,\d{2,3})*$", value):
+                filters[field] = int(value.replace(",", ""))
+            else:
+                errors.append("Amount must be a valid whole number.")
+        elif re.match(r"^\d+$", value):
+            filters[field] = int(value) if field == "challan" else value
+        else:
+            errors.append(f"{label} must contain numbers only.")
+    return filters, errors
+
+
+def batch_fingerprint(receipts):
+    payload = json.dumps(receipts, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+
+
+def archive_batch(receipts, challan_type):
+    batch_id = batch_fingerprint(receipts)
+    payload = zlib.compress(json.dumps(receipts, default=str).encode("utf-8"), 9)
+    with archive_connection() as conn, conn:
+        cur = conn.execute(
+            "INSERT OR IGNORE INTO batches VALUES (?, ?, ?, ?, ?)",
+            (
+                batch_id,
+                datetime.now().isoformat(timespec="seconds"),
+                challan_type,
+                len(receipts),
+                payload,
+            ),
+        )
+        if cur.rowcount:
+            conn.executemany(
+                "INSERT INTO receipt_index VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                [
+                    (
+                        batch_id,
+                        int(rec["challan"]),
+                        str(rec["num"]).zfill(3),
+                        str(rec["name"]),
+                        str(rec.get("month", "")),
+                        pay_no.strip(),
+                        str(rec["pay_no"]),
+                        int(str(rec["amount"]).replace(",", "")),
+                    )
+                    for rec in receipts
+                    for pay_no in str(rec["pay_no"]).split(",")
+                ],
+            )
+            conn.executemany(
+                "INSERT INTO receipt_months VALUES (?, ?, ?)",
+                [
+                    (batch_id, int(rec["challan"]), key)
+                    for rec in receipts
+                    for key in period_month_keys(rec.get("month", ""))
+                ],
+            )
+    return batch_id
+
+
+def search_archive(filters):
+    joins = []
+    clauses = []
+    params = []
+    for field, value in filters.items():
+        if field == "month":
+            joins.append("JOIN receipt_months m ON m.batch_id = r.batch_id AND m.challan = r.challan")
+            clauses.append("m.month_key = ?")
+        else:
+            clauses.append(f"r.{field} = ?")
+        params.append(value)
+
+    query = (
+        "SELECT r.batch_id, b.created, r.challan, r.consumer, r.name, r.month, "
+        "r.pay_nos AS pay_no, r.amount "
+        "FROM receipt_index r JOIN batches b ON b.batch_id = r.batch_id "
+        f"{' '.join(joins)} WHERE {' AND '.join(clauses)} "
+        "GROUP BY r.batch_id, r.challan ORDER BY b.created DESC, r.challan"
+    )
+    with archive_connection() as conn, conn:
+        return pd.read_sql_query(query, conn, params=params)
+
+
+@st.cache_resource
+def finalize_executor():
+    return ThreadPoolExecutor(max_workers=2)
+
+
+@st.cache_resource
+def finalize_jobs():
+    return {}
+
+
+@st.cache_resource
+def finalize_jobs_lock():
+    return threading.Lock()
+
+
+def archive_finished_job(job, receipts, challan_type):
+    job["warning"] = ""
+    try:
+        archive_batch(receipts, challan_type)
+    except (sqlite3.Error, ValueError) as exc:
+        job["warning"] = f"Batch was not archived: {exc}"
+
+
+def run_finalize_job(job, receipts, challan_type, stamp, archive):
+    def report(done):
+        job["done"] = min(done, job["total"])
+
+    try:
+        rendered = render_receipts(receipts, on_progress=report)
+        job["data"], job["file_name"], job["mime"] = bundle_rendered(rendered, stamp)
+    except Exception as exc:
+        job["error"] = str(exc)
+        job["status"] = "failed"
+        return
+    job["status"] = "done"
+
+    if archive:
+        archive_finished_job(job, receipts, challan_type)
+
+
+def submit_finalize_job(receipts, challan_type, stamp=None, archive=True):
+    job_id = batch_fingerprint(receipts)
+    if not archive:
+        job_id = f"archive-{job_id}"
+    jobs = finalize_jobs()
+    with finalize_jobs_lock():
+        job = jobs.get(job_id)
+        if job is not None and job["status"] == "done" and archive and job["warning"]:
+            job["warning"] = ""
+            finalize_executor().submit(archive_finished_job, job, [dict(r) for r in receipts], challan_type)
+            return job_id
+        if job is not None and job["status"] != "failed":
+            return job_id
+
+        finished = [k for k, j in jobs.items() if j["status"] != "running"]
+        for old_id in finished[: max(0, len(finished) - FINALIZE_JOB_LIMIT + 1)]:
+            jobs.pop(old_id, None)
+
+        job = {"status": "running", "done": 0, "total": len(receipts), "error": "", "warning": ""}
+        jobs[job_id] = job
+    finalize_executor().submit(
+        run_finalize_job,
+        job,
+        [dict(r) for r in receipts],
+        challan_type,
+        stamp or date.today(),
+        archive,
+    )
+    return job_id
+
+
+def load_archived_batch(batch_id):
+    with archive_connection() as conn, conn:
+        found = conn.execute("SELECT payload FROM batches WHERE batch_id = ?", (batch_id,)).fetchone()
+    if found is None:
+        return None
+    return json.loads(zlib.decompress(found[0]).decode("utf-8"))
+
+
 @st.dialog("Select Bank", width="medium")
 def bank_selection_dialog():
     st.write("### 🏦 Select Bank")
@@ -167,6 +574,17 @@ def bank_selection_dialog():
                 st.rerun()
 
 
+@st.fragment(run_every=1)
+def finalize_progress(job_id):
+    job = finalize_jobs().get(job_id)
+    if job is None or job["status"] != "running":
+        st.rerun()
+    st.progress(
+        job["done"] / max(job["total"], 1),
+        text=f"Rendering {job['done']} / {job['total']} receipts...",
+    )
+
+
 @st.dialog("Edit Amount")
 def edit_amount_dialog(index):
     rec = st.session_state.all_receipts[index]
@@ -193,6 +611,8 @@ if "show_batch" not in st.session_state:
     st.session_state.show_batch = False
 if "is_period" not in st.session_state:
     st.session_state.is_period = False
+if "is_multi" not in st.session_state:
+    st.session_state.is_multi = False
 if "consumer_key" not in st.session_state:
     st.session_state.consumer_key = 0
 if "temp_instruments" not in st.session_state:
@@ -201,8 +621,18 @@ if "challan_type" not in st.session_state:
     st.session_state.challan_type = "C. C"
 if "other_form_key" not in st.session_state:
     st.session_state.other_form_key = 0
-if "batch_purpose" not in st.session_state:
-    st.session_state.batch_purpose = ""
+if "finalize_job" not in st.session_state:
+    st.session_state.finalize_job = ""
+if "regenerate_job" not in st.session_state:
+    st.session_state.regenerate_job = ""
+if "last_other_purpose" not in st.session_state:
+    st.session_state.last_other_purpose = OTHER_PURPOSES[0]
+
+try:
+    init_archive()
+    archive_ready = True
+except sqlite3.Error:
+    archive_ready = False
 
 with st.sidebar:
     st.header("⚙️ Configuration")
@@ -269,7 +699,8 @@ with st.sidebar:
             st.session_state.temp_instruments = []
             st.session_state.selected_bank = ""
             st.session_state.other_form_key = 0
-            st.session_state.batch_purpose = ""
+            st.session_state.finalize_job = ""
+            st.session_state.last_other_purpose = OTHER_PURPOSES[0]
             st.rerun()
 
 if st.session_state.locked:
@@ -288,16 +719,20 @@ if st.session_state.locked:
         m2.metric("Date", st.session_state.formatted_pdate)
 
     try:
-        df = pd.read_excel(data_file, sheet_name="BILL")
+        df = load_master_data(data_file.getvalue())
     except Exception:
         st.error("Sheet 'BILL' not found.")
         st.stop()
 
+    year_options = master_year_options(tuple(df.columns))
+    default_year = year_options.index(YEAR_OPTIONS[0])
+
     st.divider()
 
     has_active_instruments = len(st.session_state.temp_instruments) > 0
     row = None
     total_amt = None
+    multi_entries = []
     display_month_text = ""
     purpose_value = ""
     description_value = ""
@@ -306,12 +741,17 @@ if st.session_state.locked:
     account_value = ""
 
     if st.session_state.challan_type == "C. C":
-        col_t1, _ = st.columns([0.2, 0.8])
+        col_t1, col_t2, _ = st.columns([0.2, 0.2, 0.6])
         with col_t1:
             toggle_label = "Single Month Mode" if not st.session_state.is_period else "Period Mode"
             if st.button(toggle_label, disabled=has_active_instruments):
                 st.session_state.is_period = not st.session_state.is_period
                 st.rerun()
+        with col_t2:
+            multi_label = "Single Consumer" if not st.session_state.is_multi else "Multi-Consumer"
+            if st.button(multi_label, disabled=has_active_instruments):
+                st.session_state.is_multi = not st.session_state.is_multi
+                st.rerun()
 
         if not st.session_state.is_period:
             c1, c2 = st.columns(2)
@@ -321,7 +761,7 @@ if st.session_state.locked:
                 )
             with c2:
                 sel_year = st.selectbox(
-                    "Select Year", options=YEAR_OPTIONS, index=0, disabled=has_active_instruments
+                    "Select Year", options=year_options, index=default_year, disabled=has_active_instruments
                 )
 
             display_month_text = f"{sel_month} - {sel_year}"
@@ -332,103 +772,117 @@ if st.session_state.locked:
                 f_month = st.selectbox("From Month", options=MONTH_LIST, disabled=has_active_instruments)
             with c2:
                 f_year = st.selectbox(
-                    "From Year", options=YEAR_OPTIONS, index=0, disabled=has_active_instruments
+                    "From Year", options=year_options, index=default_year, disabled=has_active_instruments
                 )
             with c3:
                 t_month = st.selectbox("To Month", options=MONTH_LIST, disabled=has_active_instruments)
             with c4:
                 t_year = st.selectbox(
-                    "To Year", options=YEAR_OPTIONS, index=0, disabled=has_active_instruments
+                    "To Year", options=year_options, index=default_year, disabled=has_active_instruments
                 )
 
-            start_date = datetime(f_year, MONTH_LIST.index(f_month) + 1, 1)
-            end_date = datetime(t_year, MONTH_LIST.index(t_month) + 1, 1)
-
-            target_months = []
-
-            if start_date <= end_date:
-                curr = start_date
-                while curr <= end_date:
-                    target_months.append((MONTH_LIST[curr.month - 1], curr.year))
-                    curr = (
-                        datetime(curr.year + 1, 1, 1)
-                        if curr.month == 12
-                        else datetime(curr.year, curr.month + 1, 1)
-                    )
-                display_month_text = format_period_month_text(target_months)
-            else:
-                st.error("'From' date must be before 'To' date.")
+            target_months, display_month_text = calendar_period(f_month, f_year, t_month, t_year)
 
             if not target_months:
-                st.warning("Selected Month-Year range is empty.")
-
-        search_num = st.text_input(
-            "Enter Consumer Number",
-            max_chars=3,
-            key=f"consumer_{st.session_state.consumer_key}",
-            disabled=has_active_instruments,
-        )
+                st.error("'From' date must be before 'To' date.")
 
-        if search_num and not re.match(r"^\d*$", search_num):
-            st.error("Consumer Number must contain numbers only.")
-        elif search_num and len(search_num) == 3 and re.match(r"^\d{3}$", search_num):
-            result = df[df["Consumer Number"].astype(str).str.zfill(3) == search_num]
+        month_cols = resolve_month_columns(tuple(df.columns), tuple(target_months))
 
-            if result.empty:
-                st.error("Consumer not found in Master Data.")
-            else:
-                row = result.iloc[0]
-                total_amt = 0
-                month_found = False
-
-                for m, y in target_months:
-                    t_abbr = f"{MONTH_ABBR[MONTH_LIST.index(m)]}-{str(y)[2:]}"
-                    t_col = next(
-                        (
-                            col
-                            for col in df.columns
-                            if str(col).strip() == t_abbr
-                            or (
-                                isinstance(col, (datetime, pd.Timestamp))
-                                and col.month == MONTH_LIST.index(m) + 1
-                                and col.year == y
-                            )
-                        ),
-                        None,
+        if st.session_state.is_multi:
+            multi_text = st.text_input(
+                "Enter Consumer Numbers",
+                placeholder="e.g. 001-005, 012, 020",
+                key=f"consumer_multi_{st.session_state.consumer_key}",
+                disabled=has_active_instruments,
+            )
+            multi_numbers = parse_consumer_numbers(multi_text) if multi_text else []
+
+            if multi_numbers is None:
+                st.error("Use 3 digit Consumer Numbers or ranges separated by commas.")
+            elif multi_numbers and not month_cols:
+                st.error("Selected Month-Year column not found in Master Data.")
+            elif multi_numbers:
+                matched, missing = lookup_consumer_totals(df, multi_numbers, month_cols)
+                if missing:
+                    st.error(f"Consumer not found in Master Data: {', '.join(missing)}")
+
+                zero_amt = matched[matched["_total"] <= 0]
+                if not zero_amt.empty:
+                    st.warning(f"Amount is zero for selected Month-Year: {', '.join(zero_amt.index)}")
+
+                skip_confirmed = True
+                if missing or not zero_amt.empty:
+                    skip_confirmed = st.checkbox(
+                        "Skip missing / zero-amount consumers",
+                        value=False,
+                        key=f"consumer_multi_skip_{st.session_state.consumer_key}",
+                        disabled=has_active_instruments,
                     )
 
-                    if t_col is not None:
-                        month_found = True
-                        total_amt += row[t_col] if not pd.isna(row[t_col]) else 0
-
-                if not month_found:
-                    st.error("Selected Month-Year column not found in Master Data.")
-                elif total_amt <= 0:
-                    st.warning("Amount is zero for selected Month-Year.")
-                else:
+                matched = matched[matched["_total"] > 0]
+                if skip_confirmed:
+                    multi_entries = [
+                        (rec, rec["_total"]) for rec in matched.to_dict("records")
+                    ]
+                if multi_entries:
                     purpose_value = "C. C. Charges"
                     description_value = display_month_text
+                    st.dataframe(
+                        pd.DataFrame(
+                            {
+                                "Consumer": matched.index,
+                                "Name": matched["Name"].values,
+                                "Amount": [format_indian_currency(a) for a in matched["_total"]],
+                            }
+                        ),
+                        hide_index=True,
+                        use_container_width=True,
+                    )
                     st.success(
-                        f"**Found:** {row['Name']} | **Total Amt:** ₹{format_indian_currency(total_amt)}"
+                        f"**Found:** {len(multi_entries)} Consumers | "
+                        f"**Total Amt:** ₹{format_indian_currency(matched['_total'].sum())}"
                     )
-
-    else:
-        purpose_locked = bool(st.session_state.batch_purpose)
-        if purpose_locked:
-            selected_other_purpose = st.selectbox(
-                "Purpose",
-                [st.session_state.batch_purpose],
-                index=0,
-                disabled=True,
-                key=f"other_purpose_locked_{st.session_state.other_form_key}",
-            )
         else:
-            selected_other_purpose = st.selectbox(
-                "Purpose",
-                OTHER_PURPOSES,
+            search_num = st.text_input(
+                "Enter Consumer Number",
+                max_chars=3,
+                key=f"consumer_{st.session_state.consumer_key}",
                 disabled=has_active_instruments,
-                key=f"other_purpose_{st.session_state.other_form_key}",
             )
+
+            if search_num and not re.match(r"^\d*$", search_num):
+                st.error("Consumer Number must contain numbers only.")
+            elif search_num and len(search_num) == 3 and re.match(r"^\d{3}$", search_num):
+                result = df[df["Consumer Number"].astype(str).str.zfill(3) == search_num]
+
+                if result.empty:
+                    st.error("Consumer not found in Master Data.")
+                else:
+                    row = result.iloc[0]
+                    total_amt = 0
+
+                    for t_col in month_cols:
+                        total_amt += row[t_col] if not pd.isna(row[t_col]) else 0
+
+                    if not month_cols:
+                        st.error("Selected Month-Year column not found in Master Data.")
+                    elif total_amt <= 0:
+                        st.warning("Amount is zero for selected Month-Year.")
+                    else:
+                        purpose_value = "C. C. Charges"
+                        description_value = display_month_text
+                        st.success(
+                            f"**Found:** {row['Name']} | **Total Amt:** ₹{format_indian_currency(total_amt)}"
+                        )
+
+    else:
+        selected_other_purpose = st.selectbox(
+            "Purpose",
+            OTHER_PURPOSES,
+            index=OTHER_PURPOSES.index(st.session_state.last_other_purpose),
+            disabled=has_active_instruments,
+            key=f"other_purpose_{st.session_state.other_form_key}",
+        )
         purpose_value = selected_other_purpose
         description_value = ""
         desc_value_4d = ""
@@ -445,7 +899,7 @@ if st.session_state.locked:
                 adv_month = st.selectbox("Month", MONTH_LIST, disabled=has_active_instruments, key=f"adv_month_{st.session_state.other_form_key}")
             with c2:
                 adv_year = st.selectbox(
-                    "Year", YEAR_OPTIONS, index=0, disabled=has_active_instruments, key=f"adv_year_{st.session_state.other_form_key}"
+                    "Year", year_options, index=default_year, disabled=has_active_instruments, key=f"adv_year_{st.session_state.other_form_key}"
                 )
             purpose_value = "Advance Payment"
             description_value = f"{adv_month} - {adv_year}"
@@ -601,7 +1055,7 @@ if st.session_state.locked:
             else:
                 st.success(f"**Found:** {row['Name']} | **Purpose:** {purpose_value}")
 
-    if row is not None and total_amt is not None:
+    if (row is not None and total_amt is not None) or multi_entries:
         b_col1, b_col2 = st.columns([0.9, 0.1], vertical_alignment="bottom")
         with b_col1:
             bank_name = st.text_input(
@@ -673,42 +1127,47 @@ if st.session_state.locked:
             elif st.session_state.challan_type == "OTHER" and selected_other_purpose == "Security Deposit and Meter Security Deposit (SD and MSD)" and total_amt is None:
                 st.error("Please enter valid SD Amount and MSD Amount.")
             else:
-                receipt = {
-                    "id": str(uuid.uuid4()),
-                    "challan": next_no,
-                    "pdate": st.session_state.formatted_pdate,
-                    "name": row["Name"],
-                    "num": row["Consumer Number"],
-                    "purpose": purpose_value,
-                    "selected_purpose": selected_other_purpose if st.session_state.challan_type == "OTHER" else "C. C",
-                    "description": description_value,
-                    "tag": tag_value,
-                    "account": account_value,
-                    "breakdown": breakdown_value,
-                    "amount": format_indian_currency(total_amt),
-                    "words": amount_words(total_amt),
-                    "pay_type": st.session_state.temp_instruments[0]["type"],
-                    "pay_no": ", ".join([i["no"] for i in st.session_state.temp_instruments]),
-                    "bank": bank_name,
-                    "date": ", ".join(list(set([i["date"] for i in st.session_state.temp_instruments]))),
-                }
-                if st.session_state.challan_type == "C. C":
-                    receipt["month"] = display_month_text
-                else:
-                    receipt["month"] = description_value
-                st.session_state.all_receipts.append(receipt)
+                entries = multi_entries if multi_entries else [(row, total_amt)]
+                new_receipts = []
+                for offset, (entry_row, entry_amt) in enumerate(entries):
+                    receipt = {
+                        "id": str(uuid.uuid4()),
+                        "challan": next_no + offset,
+                        "pdate": st.session_state.formatted_pdate,
+                        "name": entry_row["Name"],
+                        "num": entry_row["Consumer Number"],
+                        "purpose": purpose_value,
+                        "selected_purpose": selected_other_purpose if st.session_state.challan_type == "OTHER" else "C. C",
+                        "description": description_value,
+                        "tag": tag_value,
+                        "account": account_value,
+                        "breakdown": breakdown_value,
+                        "amount": format_indian_currency(entry_amt),
+                        "words": amount_words(entry_amt),
+                        "pay_type": st.session_state.temp_instruments[0]["type"],
+                        "pay_no": ", ".join([i["no"] for i in st.session_state.temp_instruments]),
+                        "bank": bank_name,
+                        "date": ", ".join(list(set([i["date"] for i in st.session_state.temp_instruments]))),
+                    }
+                    if st.session_state.challan_type == "C. C":
+                        receipt["month"] = display_month_text
+                    else:
+                        receipt["month"] = description_value
+                    new_receipts.append(receipt)
+                st.session_state.all_receipts.extend(new_receipts)
                 st.session_state.temp_instruments = []
                 st.session_state.selected_bank = ""
                 st.session_state.is_period = False
-                if st.session_state.challan_type == "OTHER" and not st.session_state.batch_purpose:
-                    st.session_state.batch_purpose = selected_other_purpose
                 if st.session_state.challan_type == "OTHER":
+                    st.session_state.last_other_purpose = selected_other_purpose
                     st.session_state.other_form_key += 1
                 st.session_state.consumer_key += 1
                 st.rerun()
 
     if st.session_state.all_receipts:
         st.divider()
+        active_job = finalize_jobs().get(st.session_state.finalize_job)
+        finalize_running = active_job is not None and active_job["status"] == "running"
         if st.checkbox("👁️ View Batch Table", value=st.session_state.show_batch):
             st.session_state.show_batch = True
             t_head = st.columns([0.7, 2.2, 1.7, 1.2, 1.2, 2, 1.1])
@@ -729,38 +1188,106 @@ if st.session_state.locked:
                 tcol[5].write(rec.get("purpose", "C. C"))
                 with tcol[6]:
                     s1, s2 = st.columns(2)
-                    if s1.button("✏️", key=f"e_{rec['id']}"):
+                    if s1.button("✏️", key=f"e_{rec['id']}", disabled=finalize_running):
                         edit_amount_dialog(i)
-                    if s2.button("🗑️", key=f"d_{rec['id']}"):
+                    if s2.button("🗑️", key=f"d_{rec['id']}", disabled=finalize_running):
                         st.session_state.all_receipts.pop(i)
                         for j in range(i, len(st.session_state.all_receipts)):
                             st.session_state.all_receipts[j]["challan"] -= 1
                         if not st.session_state.all_receipts:
-                            st.session_state.batch_purpose = ""
                             st.session_state.other_form_key += 1
                         st.rerun()
 
         if st.button("🚀 Finalize Word File", type="primary"):
-            if st.session_state.challan_type == "C. C":
-                with open(CC_ADVANCE_TEMPLATE, "rb") as f:
-                    doc = DocxTemplate(io.BytesIO(f.read()))
-            else:
-                first_selected_purpose = st.session_state.all_receipts[0].get("selected_purpose", "")
-                tpl = CC_ADVANCE_TEMPLATE if first_selected_purpose == "Advance Payment" else SD_TEMPLATE
-                if not os.path.exists(tpl):
-                    st.error(f"Template missing: {tpl}")
-                    st.stop()
-                with open(tpl, "rb") as f:
-                    doc = DocxTemplate(io.BytesIO(f.read()))
-
-            safe_receipts = [SafeReceipt(r) for r in st.session_state.all_receipts]
-            doc.render({"receipts": safe_receipts})
-            output = io.BytesIO()
-            doc.save(output)
-            output.seek(0)
-            st.download_button(
-                "📥 Download",
-                output.getvalue(),
-                file_name=f"Challans_{date.today()}.docx",
+            groups = group_receipts_by_template(st.session_state.all_receipts)
+            missing = [tpl for tpl in groups if not os.path.exists(tpl)]
+            if missing:
+                st.error(f"Template missing: {', '.join(missing)}")
+                st.stop()
+
+            st.session_state.finalize_job = submit_finalize_job(
+                st.session_state.all_receipts, st.session_state.challan_type
             )
+            st.rerun()
+
+        job = finalize_jobs().get(st.session_state.finalize_job)
+        if job is not None and st.session_state.finalize_job == batch_fingerprint(st.session_state.all_receipts):
+            if job["status"] == "running":
+                finalize_progress(st.session_state.finalize_job)
+            elif job["status"] == "failed":
+                st.error(f"Finalize failed: {job['error']}")
+            else:
+                st.download_button(
+                    "📥 Download",
+                    job["data"],
+                    file_name=job["file_name"],
+                    mime=job["mime"],
+                )
+                if job.get("warning"):
+                    st.warning(job["warning"])
+
+with st.expander("🗄️ Archive Search"):
+    if not archive_ready:
+        st.warning(f"Archive unavailable: {ARCHIVE_DB} could not be opened.")
+    else:
+        search_cols = st.columns(len(ARCHIVE_SEARCH_FIELDS))
+        raw_filters = {}
+        for search_col, (label, field) in zip(search_cols, ARCHIVE_SEARCH_FIELDS.items()):
+            with search_col:
+                raw_filters[label] = st.text_input(label, key=f"archive_{field}")
+
+        filters, filter_errors = parse_archive_filters(raw_filters)
+        for filter_error in filter_errors:
+            st.error(filter_error)
+
+        if filters and not filter_errors:
+            try:
+                matches = search_archive(filters)
+            except sqlite3.Error as exc:
+                st.error(f"Archive search failed: {exc}")
+                matches = pd.DataFrame()
+
+            if matches.empty:
+                st.info("No archived challans match this search.")
+            else:
+                st.dataframe(
+                    matches.drop(columns=["batch_id"]),
+                    hide_index=True,
+                    use_container_width=True,
+                )
+                batch_labels = {
+                    f"{created} ({batch_id})": (batch_id, created)
+                    for batch_id, created in matches[["batch_id", "created"]].drop_duplicates().itertuples(index=False)
+                }
+                r1, r2 = st.columns([0.7, 0.3], vertical_alignment="bottom")
+                with r1:
+                    batch_label = st.selectbox("Archived Batch", list(batch_labels))
+                with r2:
+                    regenerate = st.button("♻️ Re-generate")
+
+                if regenerate:
+                    batch_id, created = batch_labels[batch_label]
+                    archived = load_archived_batch(batch_id)
+                    missing = [tpl for tpl in group_receipts_by_template(archived) if not os.path.exists(tpl)]
+                    if missing:
+                        st.error(f"Template missing: {', '.join(missing)}")
+                    else:
+                        st.session_state.regenerate_job = submit_finalize_job(
+                            archived, "", stamp=created[:10], archive=False
+                        )
+                        st.rerun()
+
+        regen_job = finalize_jobs().get(st.session_state.regenerate_job)
+        if regen_job is not None:
+            if regen_job["status"] == "running":
+                finalize_progress(st.session_state.regenerate_job)
+            elif regen_job["status"] == "failed":
+                st.error(f"Re-generate failed: {regen_job['error']}")
+            else:
+                st.download_button(
+                    "📥 Download Archived Batch",
+                    regen_job["data"],
+                    file_name=regen_job["file_name"],
+                    mime=regen_job["mime"],
+                )
 